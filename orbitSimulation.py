@@ -3,14 +3,413 @@ import matplotlib.pyplot as plt
 import matplotlib.animation as Animation
 from matplotlib.text import Text as plotText
 # from typing import Union <-- Unused thus far
+import math
+import os
+import re
+import threading
+import time
 import numpy as np
 
 G = 1 # 6.67408e-11
 
+NUMBA_PARALLEL_THRESHOLD = 128
+"""
+Number of objects from which the compiled direct kernel runs on multiple threads. Only applies if Numba is installed.
+"""
+
+BARNES_HUT_THRESHOLD = 500
+"""
+Number of objects from which `Simulation(forceMethod='auto')` switches from direct summation to the Barnes-Hut approximation.
+
+Only applies when Numba is installed. In plain Python, walking the tree is slower than the `numpy` direct summation.
+"""
+
+try:
+    from numba import njit, prange, get_num_threads
+    NUMBA_AVAILABLE = True
+except ImportError: # Numba is optional, the `numpy` implementation of the kinematics is used without it
+    NUMBA_AVAILABLE = False
+    prange = range
+
+def _jit(signature: str):
+    """
+    Compiles the decorated function with Numba for `signature` if it is installed, otherwise leaves it unchanged.
+
+    With an explicit signature the function is compiled when the module is imported, and loaded from Numba's disk cache
+    on later imports, rather than being compiled during the first step of a simulation.
+    """
+    def decorator(function):
+        if NUMBA_AVAILABLE:
+            return njit(signature, fastmath=True, cache=True, nogil=True)(function)
+        return function
+    return decorator
+
+def _jitParallel(signature: str):
+    """
+    Same as `_jit`, but lets `prange` loops run in parallel.
+    """
+    def decorator(function):
+        if NUMBA_AVAILABLE:
+            return njit(signature, parallel=True, fastmath=True, cache=True, nogil=True)(function)
+        return function
+    return decorator
+
+FFMPEG_AVAILABLE = Animation.writers.is_available('ffmpeg')
+"""
+Whether matplotlib can find ffmpeg to save animations as MP4, checked once when the module is imported.
+"""
+
+_xp = np
+"""
+Array module used by the broadcasted force calculation. Changed with `setBackend`.
+"""
+
+GPU_THRESHOLD = 512
+"""
+Number of objects from which the `'cupy'` backend is used, when it is selected.
+Smaller simulations stay on the CPU, as the copies and kernel launches every step cost more than the force calculation.
+"""
+
+def setBackend(backend: str) -> None:
+    """
+    Selects the array library the broadcasted (non-Numba) force calculation runs on.
+
+    `'numpy'` runs on the CPU. `'cupy'` runs the `(N,N)` pairwise calculation on a CUDA GPU, which only pays off
+    for several thousand objects, as the positions are copied to the GPU and the accelerations back every step.
+    Simulations with fewer than `GPU_THRESHOLD` objects keep using the CPU kernels.
+    """
+    global _xp
+    if backend == 'numpy':
+        _xp = np
+    elif backend == 'cupy':
+        try:
+            import cupy
+        except ImportError:
+            raise Exception("The 'cupy' backend requires CuPy to be installed.")
+        _xp = cupy
+    else:
+        raise Exception(f"Unknown backend {backend}, expected 'numpy' or 'cupy'.")
+
+if NUMBA_AVAILABLE:
+    # Inlined into `_stepNumba` and `_stepNumbaSerial` below, which compile it with and without threading.
+    # Two separate functions also keep their entries in Numba's disk cache apart, as it does not distinguish `parallel`.
+    @njit(inline='always')
+    def _stepKernel(pos, vel, acc, mass, static, dt, G, eps2, threadAcc):
+        """
+        Compiled equivalent of `Simulation.__updateSimObjectKinematics`. Updates `pos` and `vel` in place by one time step.
+
+        `acc` holds the accelerations at the current positions, and is overwritten with the ones at the new positions,
+        ready for the next step. With `dt = 0` the objects do not move, and only `acc` is calculated.
+
+        Every pair is only evaluated once (`j > i`), the mutual force is added to one object and subtracted from the other.
+        Pairs of two static objects are skipped, as neither is moved, and static objects are given an acceleration of 0.
+        As two threads could write to the same object, each chunk accumulates into its own `(N,2)` slice of the
+        `threadAcc` scratch buffer, and the slices are summed per object in the parallel update loop.
+        """
+        n = pos.shape[0]
+        nThreads = threadAcc.shape[0]
+        threadAcc[:] = 0.0
+
+        # First half of the velocity Verlet step, with the accelerations of the previous step
+        halfDt = 0.5 * dt
+        for i in prange(n):
+            # Static objects have no velocity, so zeroing their acceleration keeps them in place without a branch
+            move = halfDt * (1.0 - static[i])
+            vel[i, 0] += acc[i, 0] * move
+            vel[i, 1] += acc[i, 1] * move
+            pos[i, 0] += vel[i, 0] * dt
+            pos[i, 1] += vel[i, 1] * dt
+
+        for t in prange(nThreads):
+            for i in range(t, n, nThreads): # Interleaved so the threads get a similar share of the triangular loop
+                # Everything that only depends on `i` is loaded once, and `G` is left out of the pair loop entirely.
+                # It is applied once per object in the update below, as `G * sum(...)` rather than `sum(G * ...)`.
+                xi = pos[i, 0]
+                yi = pos[i, 1]
+                mi = mass[i]
+                if static[i]:
+                    # Only the force on the other object of each pair is needed, and only if that object is not static.
+                    # Static objects are usually few, so the branch is kept out of the loop the other objects use.
+                    for j in range(i + 1, n):
+                        if static[j]:
+                            continue
+                        dx = pos[j, 0] - xi
+                        dy = pos[j, 1] - yi
+                        r_squared = dx * dx + dy * dy + eps2
+                        inv = mi / (r_squared * np.sqrt(r_squared))
+                        threadAcc[t, j, 0] -= inv * dx
+                        threadAcc[t, j, 1] -= inv * dy
+                    continue
+                axi = 0.0
+                ayi = 0.0
+                for j in range(i + 1, n):
+                    dx = pos[j, 0] - xi
+                    dy = pos[j, 1] - yi
+                    r_squared = dx * dx + dy * dy + eps2
+                    inv = 1.0 / (r_squared * np.sqrt(r_squared))
+                    axi += mass[j] * inv * dx
+                    ayi += mass[j] * inv * dy
+                    threadAcc[t, j, 0] -= mi * inv * dx
+                    threadAcc[t, j, 1] -= mi * inv * dy
+                threadAcc[t, i, 0] += axi
+                threadAcc[t, i, 1] += ayi
+
+        # Second half of the step, with the accelerations at the new positions
+        for i in prange(n):
+            # The per-thread slices are reduced here, one object per iteration, rather than in a separate serial pass
+            ax = 0.0 # Acceleration divided by `G`
+            ay = 0.0
+            for t in range(nThreads):
+                ax += threadAcc[t, i, 0]
+                ay += threadAcc[t, i, 1]
+            notStatic = 1.0 - static[i]
+            acc[i, 0] = G * ax * notStatic
+            acc[i, 1] = G * ay * notStatic
+            move = halfDt * notStatic
+            vel[i, 0] += acc[i, 0] * move
+            vel[i, 1] += acc[i, 1] * move
+
+    @njit('void(f8[:,:], f8[:,:], f8[:,:], f8[:], b1[:], f8, f8, f8, f8[:,:,:])', parallel=True, fastmath=True, cache=True, nogil=True)
+    def _stepNumba(pos, vel, acc, mass, static, dt, G, eps2, threadAcc):
+        """
+        Runs `_stepKernel` with its `prange` loops on multiple threads.
+        """
+        _stepKernel(pos, vel, acc, mass, static, dt, G, eps2, threadAcc)
+
+    @njit('void(f8[:,:], f8[:,:], f8[:,:], f8[:], b1[:], f8, f8, f8, f8[:,:,:])', fastmath=True, cache=True, nogil=True)
+    def _stepNumbaSerial(pos, vel, acc, mass, static, dt, G, eps2, threadAcc):
+        """
+        Runs `_stepKernel` without threading. For small N starting the threads takes longer than the step itself.
+        """
+        _stepKernel(pos, vel, acc, mass, static, dt, G, eps2, threadAcc)
+
+    @njit(['UniTuple(i8, 2)(f8[:,:], f8[:,:], f8[:,:], f8[:], b1[:], f8, f8, f8, f8[:,:,:], b1, i8, f8[:,:,:], f8[:,:,:], i8, i8, i8)',
+           'UniTuple(i8, 2)(f8[:,:], f8[:,:], f8[:,:], f8[:], b1[:], f8, f8, f8, f8[:,:,:], b1, i8, f4[:,:,:], f4[:,:,:], i8, i8, i8)'], cache=True, nogil=True)
+    def _runNumba(pos, vel, acc, mass, static, dt, G, eps2, threadAcc, parallel, steps, posHistory, velHistory, historyLength, historyStride, stepsUntilRecord):
+        """
+        Runs `steps` steps of `_stepNumba` (`_stepNumbaSerial` if not `parallel`) without returning to Python in between.
+
+        Records the history like `SimObjectList.recordHistory`, into `posHistory` and `velHistory`, which have no steps
+        if no history is kept, in `float64` or `float32`. Returns the new `historyLength` and `stepsUntilRecord`.
+        """
+        for _ in range(steps):
+            if parallel:
+                _stepNumba(pos, vel, acc, mass, static, dt, G, eps2, threadAcc)
+            else:
+                _stepNumbaSerial(pos, vel, acc, mass, static, dt, G, eps2, threadAcc)
+            stepsUntilRecord -= 1
+            if stepsUntilRecord == 0:
+                stepsUntilRecord = historyStride
+                if historyLength < posHistory.shape[0]: # Otherwise the allocated length has been reached
+                    posHistory[historyLength] = pos
+                    velHistory[historyLength] = vel
+                    historyLength += 1
+        return historyLength, stepsUntilRecord
+
+_QUADTREE_MAX_DEPTH = 48 # Objects closer than ~2**-48 of the bounding box share a leaf instead of being split further
+
+@_jit('i8[:](f8[:,:])')
+def _mortonOrder(pos):
+    """
+    Returns the indices that sort the objects along a Z-order (Morton) curve over their bounding box.
+
+    Objects that are close in this order are close in space, so inserting and traversing them in this order
+    keeps the quadtree nodes they touch, one after the other, in cache.
+    """
+    xMin = pos[:, 0].min()
+    yMin = pos[:, 1].min()
+    scale = 65535.0 / max(pos[:, 0].max() - xMin, pos[:, 1].max() - yMin, 1e-300) # 16 bits per axis
+    keys = np.zeros(pos.shape[0], dtype=np.int64)
+    for axis, shift in ((0, 0), (1, 1)): # The bits of x and y are interleaved, x in the even bits
+        bits = ((pos[:, axis] - (xMin if axis == 0 else yMin)) * scale).astype(np.int64)
+        bits = (bits | (bits << 8)) & 0x00FF00FF
+        bits = (bits | (bits << 4)) & 0x0F0F0F0F
+        bits = (bits | (bits << 2)) & 0x33333333
+        bits = (bits | (bits << 1)) & 0x55555555
+        keys |= bits << shift
+    return np.argsort(keys)
+
+@_jit('Tuple((i8, i8[:,:], i8[:], i8[:], b1[:], f8[:,:], f8[:], f8[:], f8[:,:]))(f8[:,:], f8[:], i8, i8[:])')
+def _buildQuadtree(pos, mass, capacity, order):
+    """
+    Builds the quadtree used by the Barnes-Hut approximation, as flat arrays indexed by node (the root is node 0).
+    The objects are inserted in `order`, see `_mortonOrder`.
+
+    A leaf holds a linked list of objects, starting at `firstBody[node]` and continued by `nextBody[object]`.
+    Leaves only hold more than one object once `_QUADTREE_MAX_DEPTH` is reached.
+    Returns `nodeCount = -1` if more than `capacity` nodes are needed.
+    """
+    n = pos.shape[0]
+    children = np.full((capacity, 4), -1, dtype=np.int64)
+    firstBody = np.full(capacity, -1, dtype=np.int64)
+    nextBody = np.full(n, -1, dtype=np.int64)
+    isLeaf = np.ones(capacity, dtype=np.bool_)
+    centre = np.empty((capacity, 2))
+    halfSize = np.empty(capacity)
+    nodeMass = np.zeros(capacity)
+    com = np.zeros((capacity, 2)) # Centre of mass
+
+    xMin = pos[:, 0].min()
+    xMax = pos[:, 0].max()
+    yMin = pos[:, 1].min()
+    yMax = pos[:, 1].max()
+    centre[0, 0] = (xMin + xMax) / 2
+    centre[0, 1] = (yMin + yMax) / 2
+    halfSize[0] = max(xMax - xMin, yMax - yMin) / 2 * 1.0001 + 1e-12
+    nodeCount = 1
+
+    for k in range(n):
+        b = order[k]
+        node = 0
+        depth = 0
+        while True:
+            if isLeaf[node]:
+                if firstBody[node] == -1:
+                    firstBody[node] = b
+                    break
+                if depth >= _QUADTREE_MAX_DEPTH:
+                    nextBody[b] = firstBody[node]
+                    firstBody[node] = b
+                    break
+                # The leaf already holds an object, so it is split and that object is moved down into a child
+                existing = firstBody[node]
+                firstBody[node] = -1
+                isLeaf[node] = False
+                q = int(pos[existing, 0] >= centre[node, 0]) + 2 * int(pos[existing, 1] >= centre[node, 1])
+                if nodeCount == capacity:
+                    return -1, children, firstBody, nextBody, isLeaf, centre, halfSize, nodeMass, com
+                child = nodeCount
+                nodeCount += 1
+                halfSize[child] = halfSize[node] / 2
+                centre[child, 0] = centre[node, 0] + (halfSize[child] if q & 1 else -halfSize[child])
+                centre[child, 1] = centre[node, 1] + (halfSize[child] if q & 2 else -halfSize[child])
+                children[node, q] = child
+                firstBody[child] = existing
+
+            # `node` is an internal node, so `b` continues down into the matching quadrant
+            q = int(pos[b, 0] >= centre[node, 0]) + 2 * int(pos[b, 1] >= centre[node, 1])
+            child = children[node, q]
+            if child == -1:
+                if nodeCount == capacity:
+                    return -1, children, firstBody, nextBody, isLeaf, centre, halfSize, nodeMass, com
+                child = nodeCount
+                nodeCount += 1
+                halfSize[child] = halfSize[node] / 2
+                centre[child, 0] = centre[node, 0] + (halfSize[child] if q & 1 else -halfSize[child])
+                centre[child, 1] = centre[node, 1] + (halfSize[child] if q & 2 else -halfSize[child])
+                children[node, q] = child
+                firstBody[child] = b
+                break
+            node = child
+            depth += 1
+
+    # Children always have a larger index than their parent, so walking backwards fills in every child before its parent
+    for node in range(nodeCount - 1, -1, -1):
+        m = 0.0
+        mx = 0.0
+        my = 0.0
+        if isLeaf[node]:
+            b = firstBody[node]
+            while b != -1:
+                m += mass[b]
+                mx += mass[b] * pos[b, 0]
+                my += mass[b] * pos[b, 1]
+                b = nextBody[b]
+        else:
+            for q in range(4):
+                child = children[node, q]
+                if child != -1:
+                    m += nodeMass[child]
+                    mx += nodeMass[child] * com[child, 0]
+                    my += nodeMass[child] * com[child, 1]
+        nodeMass[node] = m
+        if m > 0.0:
+            com[node, 0] = mx / m
+            com[node, 1] = my / m
+
+    return nodeCount, children, firstBody, nextBody, isLeaf, centre, halfSize, nodeMass, com
+
+@_jitParallel('void(f8[:,:], f8[:], b1[:], f8, f8, f8, f8[:,:])')
+def _barnesHutAccelerations(pos, mass, static, G, eps2, theta, acc):
+    """
+    Barnes-Hut approximation of the gravitational accelerations, written into the `(N,2)` array `acc`.
+
+    Every step the objects are sorted into a quadtree. A node whose size, seen from an object, is smaller than
+    `theta` times its distance is treated as a single mass at its centre of mass. This makes a step O(N log N)
+    rather than O(N^2). Smaller values of `theta` are more accurate, `theta = 0` gives the exact sum.
+    Static objects still attract the others, but the tree is not walked for them, and their acceleration is set to 0.
+    """
+    n = pos.shape[0]
+    if n == 0: # There is no bounding box to build the tree in
+        return
+    order = _mortonOrder(pos)
+    capacity = 2 * n + 16
+    while True:
+        nodeCount, children, firstBody, nextBody, isLeaf, centre, halfSize, nodeMass, com = _buildQuadtree(pos, mass, capacity, order)
+        if nodeCount != -1:
+            break
+        capacity *= 2
+
+    thetaSquared = theta * theta
+    for k in prange(n):
+        i = order[k] # Neighbouring iterations walk mostly the same nodes
+        if static[i]:
+            acc[i, 0] = 0.0
+            acc[i, 1] = 0.0
+            continue
+        xi = pos[i, 0]
+        yi = pos[i, 1]
+        ax = 0.0
+        ay = 0.0
+        stack = np.empty(4 * (_QUADTREE_MAX_DEPTH + 1), dtype=np.int64)
+        stack[0] = 0
+        top = 1
+        while top > 0:
+            top -= 1
+            node = stack[top]
+            if nodeMass[node] == 0.0:
+                continue
+
+            if isLeaf[node]:
+                b = firstBody[node]
+                while b != -1:
+                    if b != i:
+                        dx = pos[b, 0] - xi
+                        dy = pos[b, 1] - yi
+                        r_squared = dx * dx + dy * dy + eps2
+                        inv = mass[b] / (r_squared * np.sqrt(r_squared))
+                        ax += inv * dx
+                        ay += inv * dy
+                    b = nextBody[b]
+                continue
+
+            dx = com[node, 0] - xi
+            dy = com[node, 1] - yi
+            r_squared = dx * dx + dy * dy
+            size = 2 * halfSize[node]
+            # Nodes containing the object itself are always opened, so it never feels its own mass
+            inside = abs(xi - centre[node, 0]) <= halfSize[node] and abs(yi - centre[node, 1]) <= halfSize[node]
+            if not inside and size * size < thetaSquared * r_squared:
+                r_squared += eps2
+                inv = nodeMass[node] / (r_squared * np.sqrt(r_squared))
+                ax += inv * dx
+                ay += inv * dy
+            else:
+                for q in range(4):
+                    if children[node, q] != -1:
+                        stack[top] = children[node, q]
+                        top += 1
+
+        acc[i, 0] = G * ax
+        acc[i, 1] = G * ay
+
 class Vector(np.ndarray):
     """
     Redefines the `numpy.array` class to make it easier to work with.
     All properties are inherited, but default data type is changed to `float64`.
+
+    No longer used by the simulation itself, which stores and returns plain `float64` arrays, as every operation on a
+    subclass of `numpy.ndarray` pays for an extra Python-level dispatch. Kept so existing code creating `Vector`s still works.
     """
     def __new__(cls, object):
         obj = np.asarray(object, dtype=np.float64).view(cls)
@@ -20,18 +419,307 @@ class SimObject:
         """
         Class which defines the properties of an object in the simulation. 
         Used to add new objects to the simulation, and to access their properties.
+
+        Once added to a simulation, the kinematic properties (`position`, `velocity`, `mass`, `isStatic`) are no longer
+        stored on the object itself. They live in the arrays of the `SimObjectList` the object belongs to, and the object
+        only keeps its index into those arrays.
         """
-        name: str = ''
-        mass: float = 1.00
-        position: Vector = Vector([0,0])
-        velocity: Vector = Vector([0,0])
+        __slots__ = ('name', '_parent', '_idx', '_mass', '_isStatic', '_position', '_velocity')
+        name: str
 
-        def __init__(self, name = 'object', isStatic: bool = False, mass = 1.00, position = [0,0], velocity = [0,0]) -> None:
+        def __init__(self, name = 'object', isStatic: bool = False, mass = 1.00, position = (0,0), velocity = (0,0)) -> None:
             self.name = name
-            self.mass = mass
-            self.isStatic = isStatic
-            self.position = Vector(position)
-            self.velocity = Vector(velocity) if not isStatic else Vector([0,0])
+            self._parent: SimObjectList = None # Set once the object is added to a `SimObjectList`
+            self._idx: int = -1 # Index of the object within the arrays of `_parent`
+
+            # Values held until the object is added to a simulation
+            self._mass = float(mass)
+            self._isStatic = bool(isStatic)
+            self._position: np.ndarray = np.array(position, dtype=np.float64)
+            self._velocity: np.ndarray = np.array(velocity, dtype=np.float64) if not isStatic else np.zeros(2)
+
+        def _attach(self, parent: 'SimObjectList', idx: int) -> None:
+            """
+            Moves the properties of the object into the arrays of `parent` at index `idx`.
+            """
+            parent._pos[idx] = self._position
+            parent._vel[idx] = self._velocity
+            parent._mass[idx] = self._mass
+            parent._static[idx] = self._isStatic
+            self._parent = parent
+            self._idx = idx
+
+        @property
+        def position(self) -> np.ndarray:
+            if self._parent is None:
+                return self._position
+            return self._parent._pos[self._idx]
+
+        @position.setter
+        def position(self, value) -> None:
+            if self._parent is None:
+                self._position = np.array(value, dtype=np.float64)
+            else:
+                self._parent._pos[self._idx] = value
+                self._parent.accelerationsValid = False
+
+        @property
+        def velocity(self) -> np.ndarray:
+            if self._parent is None:
+                return self._velocity
+            return self._parent._vel[self._idx]
+
+        @velocity.setter
+        def velocity(self, value) -> None:
+            if self.isStatic: # Static objects never have a velocity, which the kinematics rely on to keep them in place
+                value = (0, 0)
+            if self._parent is None:
+                self._velocity = np.array(value, dtype=np.float64)
+            else:
+                self._parent._vel[self._idx] = value
+
+        @property
+        def speed(self) -> float:
+            """
+            Magnitude of the velocity of the object.
+            """
+            velocity = self._velocity if self._parent is None else self._parent._vel[self._idx]
+            return math.sqrt(velocity[0] * velocity[0] + velocity[1] * velocity[1]) # Much cheaper than `np.linalg.norm` for 2 elements
+
+        @property
+        def mass(self) -> float:
+            if self._parent is None:
+                return self._mass
+            return float(self._parent._mass[self._idx])
+
+        @mass.setter
+        def mass(self, value) -> None:
+            if self._parent is None:
+                self._mass = float(value)
+            else:
+                self._parent._mass[self._idx] = value
+                self._parent.accelerationsValid = False
+                self._parent._deviceMasses = None
+
+        @property
+        def isStatic(self) -> bool:
+            if self._parent is None:
+                return self._isStatic
+            return bool(self._parent._static[self._idx])
+
+        @isStatic.setter
+        def isStatic(self, value) -> None:
+            if value: # Static objects never have a velocity, which the kinematics rely on
+                self.velocity = np.zeros(2)
+            if self._parent is None:
+                self._isStatic = bool(value)
+            else:
+                self._parent._static[self._idx] = value
+                self._parent.accelerationsValid = False # Static objects have no cached acceleration
+
+        def getPositionAtIndex(self, index: int) -> np.ndarray:
+            """
+            Returns the position of the object at step `index` of the simulation's history.
+            """
+            self.__checkHistory()
+            return self._parent.positionHistory[index, self._idx]
+
+        def getVelocityAtIndex(self, index: int) -> np.ndarray:
+            """
+            Returns the velocity of the object at step `index` of the simulation's history.
+            """
+            self.__checkHistory()
+            return self._parent.velocityHistory[index, self._idx]
+
+        def __checkHistory(self) -> None:
+            if self._parent is None or self._parent._posHistory is None:
+                raise Exception(f"Object {self.name} has no history, as it has not been part of a simulation that was run, or the simulation had a historyStride of 0.")
+
+class SimObjectList:
+    """
+    Container for the `SimObject`s of a simulation.
+
+    The kinematic state of the objects is stored as a structure of arrays: `positions` and `velocities` are `(N,2)`
+    arrays, `masses` and `staticMask` are `(N,)` arrays. This allows the force calculation to work on contiguous
+    `numpy` arrays instead of looking up the properties of every `SimObject` individually.
+    """
+
+    __slots__ = ('objects', 'names', '_pos', '_vel', '_mass', '_static', '_acc', 'accelerationsValid', '_posHistory', '_velHistory', '_historyLength', '_historyStride', '_stepsUntilRecord', '_accScratch', '_deviceMasses')
+
+    def __init__(self, capacity: int = 8) -> None:
+        self.objects: list[SimObject] = []
+        self.names: dict[str, int] = {} # Index of every object by name, for quick uniqueness checks and lookups
+        # Buffers are over-allocated and grow geometrically, only the first `len(self)` rows are valid.
+        self._pos: np.ndarray = np.empty((capacity, 2), dtype=np.float64)
+        self._vel: np.ndarray = np.empty((capacity, 2), dtype=np.float64)
+        self._mass: np.ndarray = np.empty(capacity, dtype=np.float64)
+        self._static: np.ndarray = np.empty(capacity, dtype=bool)
+        self._acc: np.ndarray = np.zeros((capacity, 2), dtype=np.float64)
+
+        # Whether `accelerations` belong to the current positions and masses.
+        # Reset when an object is added or moved, or its mass is changed, through the `SimObject` properties.
+        self.accelerationsValid: bool = False
+
+        # Trajectory history, allocated once the length of the simulation is known (see `allocateHistory`)
+        self._posHistory: np.ndarray = None
+        self._velHistory: np.ndarray = None
+        self._historyLength: int = 0
+        self._historyStride: int = 1
+        self._stepsUntilRecord: int = 1
+
+        # Reused between steps so the kinematics don't allocate their acceleration buffers every time (see `accelerationScratch`)
+        self._accScratch: np.ndarray = np.empty((1, 0, 2), dtype=np.float64)
+
+        # Copy of the masses on the device of the GPU backend, kept until the masses change (see `deviceMasses`)
+        self._deviceMasses = None
+
+    def __len__(self) -> int:
+        return len(self.objects)
+
+    def __iter__(self):
+        return iter(self.objects)
+
+    def __getitem__(self, index: int | str) -> SimObject:
+        """
+        Returns the object at `index`, or the object named `index` if it is a string.
+        """
+        if isinstance(index, str):
+            return self.objects[self.names[index]]
+        return self.objects[index]
+
+    def append(self, simObject: SimObject) -> None:
+        """
+        Adds `simObject` to the list and moves its properties into the arrays of the list.
+        An object can only belong to one list, as it reads its properties from the arrays of that list.
+        """
+        if simObject._parent is not None:
+            raise Exception(f"Object {simObject.name} already belongs to a simulation, and cannot be added to another one.")
+
+        n = len(self.objects)
+        if n == len(self._mass):
+            self.__grow(max(2 * n, 1))
+
+        simObject._attach(self, n)
+        self.objects.append(simObject)
+        self.names[simObject.name] = n
+        self.accelerationsValid = False
+        self._deviceMasses = None
+
+    def __grow(self, capacity: int) -> None:
+        n = len(self.objects)
+        for attr in ('_pos', '_vel', '_mass', '_static', '_acc'):
+            old: np.ndarray = getattr(self, attr)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:n] = old[:n]
+            setattr(self, attr, new)
+
+    @property
+    def positions(self) -> np.ndarray:
+        """`(N,2)` array of the positions of all objects."""
+        return self._pos[:len(self.objects)]
+
+    @property
+    def velocities(self) -> np.ndarray:
+        """`(N,2)` array of the velocities of all objects."""
+        return self._vel[:len(self.objects)]
+
+    @property
+    def speeds(self) -> np.ndarray:
+        """`(N,)` array of the speeds of all objects."""
+        velocities = self.velocities
+        return np.sqrt(np.einsum('ij,ij->i', velocities, velocities))
+
+    @property
+    def masses(self) -> np.ndarray:
+        """`(N,)` array of the masses of all objects."""
+        return self._mass[:len(self.objects)]
+
+    @property
+    def staticMask(self) -> np.ndarray:
+        """`(N,)` boolean array, `True` where the object is static."""
+        return self._static[:len(self.objects)]
+
+    @property
+    def accelerations(self) -> np.ndarray:
+        """`(N,2)` array of the gravitational accelerations of all objects, kept between steps (see `accelerationsValid`)."""
+        return self._acc[:len(self.objects)]
+
+    def deviceMasses(self, xp):
+        """
+        Returns `masses` as an array of the array module `xp` (see `setBackend`).
+        The copy is kept between steps, so only the positions have to be copied to the device every step.
+        """
+        if self._deviceMasses is None or not isinstance(self._deviceMasses, xp.ndarray):
+            self._deviceMasses = xp.asarray(self.masses)
+        return self._deviceMasses
+
+    def accelerationScratch(self, nSlices: int = 1) -> np.ndarray:
+        """
+        Returns an uninitialized `(nSlices,N,2)` buffer for the kinematics to write accelerations into.
+        The same buffer is returned as long as the shape does not change.
+        """
+        shape = (nSlices, len(self.objects), 2)
+        if self._accScratch.shape != shape:
+            self._accScratch = np.empty(shape, dtype=np.float64)
+        return self._accScratch
+
+    @property
+    def positionHistory(self) -> np.ndarray:
+        """`(T,N,2)` array of the positions of all objects at every recorded step, see `Simulation.historyStride`."""
+        return self._posHistory[:self._historyLength]
+
+    @property
+    def velocityHistory(self) -> np.ndarray:
+        """`(T,N,2)` array of the velocities of all objects at every recorded step."""
+        return self._velHistory[:self._historyLength]
+
+    @property
+    def speedHistory(self) -> np.ndarray:
+        """`(T,N)` array of the speeds of all objects at every recorded step, calculated from `velocityHistory`."""
+        velocityHistory = self.velocityHistory
+        return np.sqrt(np.einsum('tij,tij->ti', velocityHistory, velocityHistory))
+
+    def allocateHistory(self, length: int, stride: int = 1, dtype = 'float64') -> None:
+        """
+        Allocates the history for `length` recorded steps in a single block, and records the current state as the first.
+        After that, a step is recorded on every `stride`-th call of `recordHistory`. With `length = 0` no history is kept.
+        The history is stored in `dtype`, see `Simulation.historyPrecision`.
+        Objects should not be added after this is called.
+        """
+        if length == 0:
+            self._posHistory = None
+            self._velHistory = None
+            self._historyLength = 0
+            return
+
+        n = len(self.objects)
+        self._posHistory = np.empty((length, n, 2), dtype=dtype)
+        self._velHistory = np.empty((length, n, 2), dtype=dtype)
+        self._historyLength = 0
+        self._historyStride = stride
+        self._stepsUntilRecord = stride
+        self.__writeHistory()
+
+    def recordHistory(self) -> None:
+        """
+        Called after every step, copies the current positions and velocities into the next step of the history
+        if `stride` steps have passed since the last one recorded (see `allocateHistory`).
+        """
+        if self._posHistory is None:
+            return
+        self._stepsUntilRecord -= 1
+        if self._stepsUntilRecord > 0:
+            return
+        self._stepsUntilRecord = self._historyStride
+        self.__writeHistory()
+
+    def __writeHistory(self) -> None:
+        if self._historyLength >= len(self._posHistory):
+            return # The allocated length has been reached
+
+        self._posHistory[self._historyLength] = self.positions
+        self._velHistory[self._historyLength] = self.velocities
+        self._historyLength += 1
 
 class Simulation:
     """
@@ -54,7 +742,65 @@ class Simulation:
     """
     Number of iterations before the simulation concludes.
     
-    Caution the use of large values, as memory is aggregated during the simulation's execution.
+    Caution the use of large values, as the history of every object is allocated for this many iterations,
+    unless `historyStride` is changed.
+    """
+
+    historyStride: int = 1
+    """
+    Number of iterations between the steps recorded in the history of `simObjectList`, starting with the initial state.
+    `0` keeps no history at all, so the memory used does not grow with `maxIterations`.
+    """
+
+    historyPrecision: str = 'float64'
+    """
+    Floating point type the history of `simObjectList` is stored in, `'float64'` or `'float32'`.
+
+    `'float32'` halves the memory of long histories, at the cost of ~7 significant digits in the recorded values.
+    Only the recorded copies are affected, the simulation itself always runs in `float64`.
+    """
+
+    maxRealTime: float = None
+    """
+    Number of seconds, in real time, after which the simulation concludes even if `maxIterations` has not been reached.
+    Counted from the first iteration or the first drawn frame, so setting up the figure is not included. `None` for no limit.
+    """
+
+    substepsPerFrame: int = 1
+    """
+    Number of iterations simulated for every frame of the animation.
+
+    Drawing a frame takes much longer than an iteration for all but very large simulations,
+    so higher values make the animation progress faster without making `dt` larger.
+    """
+
+    viewBounds: tuple[float, float, float, float] = None
+    """
+    Fixed limits of the animation's view, as `(xMin, xMax, yMin, yMax)`.
+    If `None`, the view follows the objects, which needs a full redraw of the figure whenever it moves.
+    """
+
+    backgroundPhysics: bool = False
+    """
+    If `True`, the iterations are simulated as fast as possible on a separate thread, and each frame of the animation
+    shows the latest iteration, rather than the animation simulating `substepsPerFrame` iterations per frame.
+
+    Not used when the animation is saved, as the saved frames would then depend on the timing of the two threads.
+    """
+
+    saveAnimation: bool = False
+    """
+    If `True`, the animation is saved to `output<number>.mp4` in the working directory instead of being shown,
+    numbered one higher than the highest earlier output.
+
+    Encoded with ffmpeg, which is much faster and gives much smaller files than a GIF.
+    If ffmpeg is not installed, it is saved as `output<number>.gif` with Pillow instead.
+    """
+
+    encodingSpeed: str = 'fast'
+    """
+    ffmpeg preset used when saving the animation, such as `'ultrafast'`, `'fast'` or `'medium'`.
+    Faster presets encode quicker, but give larger files.
     """
 
     animation: Animation.FuncAnimation = None
@@ -62,18 +808,75 @@ class Simulation:
     If `displayAnimation` is `True`, then this variable will inhertic the animation object provided by `animation.`
     """
 
-    data: list[list[SimObject]] = [[]]
+    simObjectList: SimObjectList = None
     """
-    Array which contains the data produced by the simulation.
+    Contains the objects of the simulation, along with their current positions and velocities.
     """
 
     dt: float = 0.01
 
-    def __init__(self, refreshRate = 1000, displayAnimation = True, maxIterations = 1000, dt = 0.01) -> None:
+    forceMethod: str = 'auto'
+    """
+    How the gravitational forces are calculated.
+
+    `'direct'` sums the forces of every pair of objects, which is exact but scales with N^2.
+    `'barnesHut'` approximates distant groups of objects by their centre of mass, which scales with N log N.
+    `'auto'` uses `'barnesHut'` once there are at least `BARNES_HUT_THRESHOLD` objects, if Numba is installed.
+    """
+
+    theta: float = 0.5
+    """
+    Opening angle of the Barnes-Hut approximation. Smaller values are more accurate but slower.
+    """
+
+    softening: float = 0.0
+    """
+    Softening length added to every distance, as `r^2 + softening^2`, when calculating the forces.
+    Keeps the forces finite during close encounters. The default of `0` gives the exact inverse-square law.
+    """
+
+    precision: str = 'float64'
+    """
+    Floating point type of the pairwise `(N,N)` arrays in the `numpy` force calculation, `'float64'` or `'float32'`.
+    Also applies to the `'cupy'` backend (see `setBackend`).
+
+    `'float32'` halves the memory those arrays need and move, which is the limiting factor for large N, at the cost of
+    ~7 significant digits in the forces. Positions and velocities are always integrated in `float64`.
+
+    The Numba kernel always uses `float64`: its pair loop scatters into both objects of a pair, which keeps it from
+    being vectorized, so `float32` only adds conversions there.
+    """
+
+    def __init__(self, refreshRate = 1000, displayAnimation = True, maxIterations = 1000, dt = 0.01, *, historyStride = 1, historyPrecision = 'float64', maxRealTime = None, substepsPerFrame = 1, viewBounds = None, backgroundPhysics = False, saveAnimation = False, encodingSpeed = 'fast', forceMethod = 'auto', theta = 0.5, softening = 0.0, precision = 'float64') -> None:
+        if forceMethod not in ('auto', 'direct', 'barnesHut'):
+            raise Exception(f"Unknown force method {forceMethod}, expected 'auto', 'direct' or 'barnesHut'.")
+        if precision not in ('float64', 'float32'):
+            raise Exception(f"Unknown precision {precision}, expected 'float64' or 'float32'.")
+        if historyPrecision not in ('float64', 'float32'):
+            raise Exception(f"Unknown history precision {historyPrecision}, expected 'float64' or 'float32'.")
+        if not isinstance(substepsPerFrame, (int, np.integer)) or substepsPerFrame < 1:
+            raise Exception(f"Invalid substepsPerFrame {substepsPerFrame}, expected an integer of at least 1.")
+        if not isinstance(historyStride, (int, np.integer)) or historyStride < 0:
+            raise Exception(f"Invalid historyStride {historyStride}, expected an integer of at least 0 (0 keeps no history).")
+
         self.refreshRate = refreshRate
         self.displayAnimation = displayAnimation
         self.maxIterations = maxIterations
+        self.historyStride = historyStride
+        self.historyPrecision = historyPrecision
+        self.maxRealTime = maxRealTime
+        self.substepsPerFrame = substepsPerFrame
+        self.viewBounds = viewBounds
+        self.backgroundPhysics = backgroundPhysics
+        self.saveAnimation = saveAnimation
+        self.encodingSpeed = encodingSpeed
         self.dt = dt
+        self.forceMethod = forceMethod
+        self.theta = theta
+        self.softening = softening
+        self.precision = precision
+        self.simObjectList = SimObjectList()
+        self.__nextObjectId: int = 1 # Number used for the next generic name, only ever increases
 
     def addObject(self, simObject: SimObject):
         """
@@ -90,20 +893,39 @@ class Simulation:
 
         # Following code has issues that could be frustraiting for users. Will adjust later 
 
+        if simObject._parent is not None: # Checked before the object is renamed below
+            raise Exception(f"Object {simObject.name} already belongs to a simulation, and cannot be added to another one.")
+
         if simObject.name == 'object': # Gives the `SimObject` a unique name if it uses the generic name `object`.
-            simObject.name = f"object{len(self.data[0]) + 1}"
+            while f"object{self.__nextObjectId}" in self.simObjectList.names: # Skips numbers already taken by user given names
+                self.__nextObjectId += 1
+            simObject.name = f"object{self.__nextObjectId}"
+            self.__nextObjectId += 1
         
-        if len(self.data[0]) > 0:
-            for storedSimObject in self.data[0]: # Checks to see if name is unique, which must be the case for __updateSimObjectKinematics to work correctly
-                if simObject.name == storedSimObject.name:
-                    raise Exception(f"Object with name {simObject.name} already exists in simulation.")
-            
-        self.data[0].append(simObject)
+        if simObject.name in self.simObjectList.names: # Names must be unique, checked against a dict rather than every stored object
+            raise Exception(f"Object with name {simObject.name} already exists in simulation.")
+
+        self.simObjectList.append(simObject)
 
     def run(self):
         """
         Executes the simulation with the current settings.
         """
+        # +1 as the initial state is recorded too
+        historyLength: int = self.maxIterations // self.historyStride + 1 if self.historyStride > 0 else 0
+        self.simObjectList.allocateHistory(historyLength, self.historyStride, self.historyPrecision)
+
+        # The kinematics keep static objects in place by never giving them a velocity, which writing directly into
+        # the velocity array could have done
+        self.simObjectList.velocities[self.simObjectList.staticMask] = 0.0
+        # The arrays could also have been written to directly since the last step, without going through the setters that
+        # invalidate what is derived from them, so the accelerations and device masses are always calculated again
+        self.simObjectList.accelerationsValid = False
+        self.simObjectList._deviceMasses = None
+
+        # Time on the monotonic clock at which `maxRealTime` is reached, so every check is a single integer comparison.
+        # Only set once the simulation starts, see `__startDeadline`.
+        self.__deadline: int = None
 
         if self.displayAnimation:
             self.__executeDisplayedSimulation()
@@ -111,136 +933,390 @@ class Simulation:
             self.__executeNumbericalSimulation()
     
     def __executeDisplayedSimulation(self):
-        # Set up video encoding
-        Writer = Animation.writers['pillow']
-        writer = Writer(fps=15, metadata=dict(artist='Me'), bitrate=1800)
-
         # Sets up matplotlib graph
         style.use('fivethirtyeight')
         fig     = plt.figure()
         ax = fig.add_subplot(1,1,1)
-        axText: plotText = ax.text(0.05, 0.95, f'', transform=ax.transAxes, fontsize=14, verticalalignment='top', bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5))
+        # Artists that change every frame are `animated`, so they are left out of the background and only they are redrawn (blitted).
+        # The rounded box behind the text does not change, so it is drawn once into the background, sized by invisible
+        # placeholder text as long as the longest text expected, and only the text itself is animated.
+        hudFormat: str = 'Iteration: %d\nFrame time: %d ms' # `%` formatting is cheaper than an f-string for this shape
+        ax.text(0.05, 0.95, hudFormat % (self.maxIterations, 1000), transform=ax.transAxes, fontsize=14, verticalalignment='top', color='none', bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.5))
+        axText: plotText = ax.text(0.05, 0.95, f'', transform=ax.transAxes, fontsize=14, verticalalignment='top', animated=True)
         ax.set_title('Orbit Simulation')
 
-        plotLines: list[plt.Line2D] = []
+        # The drawn positions of all objects of one colour are the markers of a single line, so each frame updates at most
+        # two artists, instead of one line per object. Lines of markers are drawn much faster than a scatter plot.
+        trailGroups: list[tuple[plt.Line2D, np.ndarray]] = []
+        for static, colour in ((True, 'blue'), (False, 'red')):
+            indices: np.ndarray = np.flatnonzero(self.simObjectList.staticMask == static)
+            if len(indices):
+                line: plt.Line2D = ax.plot(*self.simObjectList.positions[indices].T, 'o', color=colour, animated=True)[0]
+                trailGroups.append((line, indices))
+        trailLines: tuple[plt.Line2D] = tuple(line for line, _ in trailGroups)
 
-        for simObject in self.data[0]: # Initalize plot
-            plotLines.append(ax.plot(simObject.position[0], simObject.position[1], 'o', color = 'blue' if simObject.isStatic else'red')[0])
+        # The last `trailLength` positions of every object are kept in a ring buffer, which is written one frame at a time,
+        # instead of growing and slicing the data of every line each frame
+        trailLength: int = 50
+        # Only used for drawing, so `float32` is precise enough and halves the data copied into the points every frame
+        trail: np.ndarray = np.empty((trailLength, len(self.simObjectList), 2), dtype=np.float32)
+        trail[0] = self.simObjectList.positions
+        trailHead: int = 1      # Index the next step is written to
+        trailFilled: int = 1    # Number of steps written so far, up to `trailLength`
+        # Changing the text makes matplotlib lay it out again, so it is only changed once `hudInterval` nanoseconds have passed
+        # since it last was, and on the last frame. At low frame rates that is still every frame.
+        hudInterval: int = 100_000_000
+        hudUpdated: int = 0 # Time on the monotonic clock the text was last changed at
 
+        iteration: int = 0      # Number of iterations simulated so far, which can differ from the frame number `i`
+        finished: bool = False
+        previousTime: int = time.perf_counter_ns() # Integer nanoseconds from a monotonic clock, cheaper than `datetime` objects
 
-        def animate(i, simInstance: Simulation):
-            # Updates the graph with the latest simulated data
+        # Simulates the iterations while the animation is shown, if `backgroundPhysics` is used, started below
+        physicsThread: threading.Thread = None
 
+        # Latest state of the physics thread. Copied under the lock, so a frame never shows a partly updated iteration,
+        # and independent of the history, which may only record some iterations or none at all
+        snapshotLock: threading.Lock = threading.Lock()
+        snapshotPositions: np.ndarray = self.simObjectList.positions.copy()
+        snapshotIteration: int = 0
 
-            # Uses the latest data to determine new positions/velocities
-            simInstance.data.append( data := self.__updateSimObjectKinematics(simInstance.data[-1]) )
-            
-            # Updates each simObjects line to update the graph
-            largest_abs_val = 0
+        def recordSnapshot(k: int) -> None:
+            nonlocal snapshotIteration
+            with snapshotLock:
+                snapshotPositions[:] = self.simObjectList.positions
+                snapshotIteration = k
 
-            for line, objectData in zip(plotLines, data):
-                (x,y) = line.get_data()
+        # Current view, only changed when a trail leaves it or the objects take up a small part of it,
+        # as every change redraws the whole figure instead of just the animated artists
+        viewCentre: np.ndarray = np.zeros(2, dtype=np.float32)
+        viewHalfSize: float = 0.0
 
-                x = np.concatenate((x, [objectData.position[0]]), axis=0)
-                y = np.concatenate((y, [objectData.position[1]]), axis=0)
+        def updateArtists(positions: np.ndarray, iteration: int, frameTime: int, updateText: bool = True) -> tuple:
+            # Draws the trails, moving the view if needed, and returns the artists to blit
+            nonlocal viewHalfSize
 
-                if len(x) > 50:
-                    x = x[-50:]
-                    y = y[-50:]
-                
+            # The trails are drawn as points only, so the order of the steps does not matter and the buffer is used as it is.
+            # Until the buffer is full, the steps are written from the start of it with no gaps.
+            visibleTrail: np.ndarray = trail[:trailFilled]
+            for line, indices in trailGroups:
+                points: np.ndarray = visibleTrail[:, indices].reshape(-1, 2)
+                line.set_data(points[:, 0], points[:, 1])
 
-                if abs(y.max()) > largest_abs_val: largest_abs_val = abs(y.max())
-                if abs(x.max()) > largest_abs_val: largest_abs_val = abs(x.max())
+            # Otherwise the view is fixed, and was set before the first frame. Without objects there is nothing to centre on.
+            if self.viewBounds is None and len(self.simObjectList) > 0:
+                # The view is centred on the objects, and sized by the furthest point of any drawn trail from that centre.
+                # Both are single `numpy` reductions over the whole trail window, rather than comparisons per object.
+                window: np.ndarray = visibleTrail.reshape(-1, 2)
+                outOfView: bool = np.abs(window - viewCentre).max() > viewHalfSize
+                centre: np.ndarray = positions.mean(axis=0).astype(np.float32) # Keeps the reductions below in `float32`, like the trail
+                offsets: np.ndarray = window - centre
+                maxDeviation: float = np.sqrt(np.einsum('ij,ij->i', offsets, offsets).max()) * 1.33 or 1.0 # Falls back to 1 if all objects overlap
 
-                line.set_data(x, y)
+                if outOfView or maxDeviation < 0.5 * viewHalfSize:
+                    viewCentre[:] = centre
+                    viewHalfSize = maxDeviation
+                    ax.set_xlim(centre[0] - maxDeviation, centre[0] + maxDeviation)
+                    ax.set_ylim(centre[1] - maxDeviation, centre[1] + maxDeviation)
+                    fig.canvas.draw() # Redraws the axes with the new limits, which the animation then uses as its background
 
-            axText.set_text(f'Iteration: {i}')
-            ax.set_xlim(-largest_abs_val * 1.33, largest_abs_val * 1.33)
-            ax.set_ylim(-largest_abs_val * 1.33, largest_abs_val * 1.33)
+            if updateText:
+                axText.set_text(hudFormat % (iteration, frameTime))
+            return (*trailLines, axText)
 
-            if i + 1 >= simInstance.maxIterations:
+        def init():
+            # Draws the current state without simulating, both before the animation is shown and before it is saved
+            nonlocal previousTime, viewHalfSize
+            previousTime = time.perf_counter_ns()
+            viewHalfSize = 0.0 # Always sets the view, as the figure has not been drawn with it yet
+            if self.viewBounds is not None:
+                ax.set_xlim(self.viewBounds[0], self.viewBounds[1])
+                ax.set_ylim(self.viewBounds[2], self.viewBounds[3])
+                fig.canvas.draw()
+            with snapshotLock:
+                positions: np.ndarray = self.simObjectList.positions if physicsThread is None else snapshotPositions.copy()
+            return updateArtists(positions, iteration, 0)
+
+        def animate(i, simInstance: Simulation):
+            # Updates the graph with the latest simulated data
+            nonlocal trailHead, trailFilled, iteration, finished, previousTime, hudUpdated
+
+            self.__startDeadline() # Not in `init`, which matplotlib already calls when the animation is created
+            now: int = time.perf_counter_ns()
+            timedOut: bool = self.__deadline is not None and now >= self.__deadline
+
+            if physicsThread is None:
+                # Uses the latest data to determine new positions/velocities, `substepsPerFrame` times before drawing the frame
+                substeps: int = 0 if timedOut else min(simInstance.substepsPerFrame, simInstance.maxIterations - iteration)
+                for _ in range(substeps):
+                    self.__updateSimObjectKinematics(simInstance.simObjectList)
+                iteration += substeps
+                positions: np.ndarray = simInstance.simObjectList.positions
+                physicsDone: bool = True
+            else:
+                # Checked before reading, so the last iteration is always shown once the thread is done
+                physicsDone: bool = not physicsThread.is_alive()
+                with snapshotLock:
+                    positions: np.ndarray = snapshotPositions.copy()
+                    iteration = snapshotIteration
+
+            trail[trailHead] = positions
+            trailHead = (trailHead + 1) % trailLength
+            trailFilled = min(trailFilled + 1, trailLength)
+
+            frameTime: int = (now - previousTime) // 1_000_000 # Time since the previous frame in ms
+            previousTime = now
+            lastFrame: bool = not finished and physicsDone and (iteration >= simInstance.maxIterations or timedOut)
+            updateText: bool = lastFrame or now - hudUpdated >= hudInterval
+            if updateText:
+                hudUpdated = now
+            artists: tuple = updateArtists(positions, iteration, frameTime, updateText=updateText)
+
+            if lastFrame:
+                finished = True
                 simInstance.animation.pause()
                 print("Animation finished.")
-            
 
-        self.animation = Animation.FuncAnimation(fig, animate, fargs=[self], interval=self.refreshRate, blit=False)
-        plt.show()
-        
-        # Uncomment if you wish to save a video
-        # self.animation.save('./example.gif', writer=writer)
+            return artists
+
+        # The number of frames is known up front, unless the frames follow a background thread. No frame data is cached,
+        # as every frame is drawn from the simulation state rather than from the frame number.
+        frameCount: int = math.ceil(self.maxIterations / self.substepsPerFrame)
+        useBackgroundPhysics: bool = self.backgroundPhysics and not self.saveAnimation
+
+        def savedFrames():
+            # Ends the saved animation on the frame the simulation concluded on, which is earlier than `frameCount`
+            # if `maxRealTime` is reached, instead of padding it with copies of that frame
+            for i in range(frameCount):
+                yield i
+                if finished:
+                    return
+
+        frames = savedFrames if self.saveAnimation else None if useBackgroundPhysics else frameCount
+        self.animation = Animation.FuncAnimation(fig, animate, frames=frames, init_func=init, fargs=[self], save_count=frameCount if self.saveAnimation else None,
+                                                 interval=self.refreshRate, blit=True, repeat=False, cache_frame_data=False)
+
+        if self.saveAnimation:
+            writer, extension = self.__animationWriter()
+            # Numbered after the highest earlier output, found with a single scan of the directory rather than a check per number
+            outputPattern: re.Pattern = re.compile(rf'output(\d+)\.{extension}')
+            numbers: list[int] = [int(match.group(1)) for name in os.listdir('.') if (match := outputPattern.fullmatch(name))]
+            i: int = max(numbers) + 1 if numbers else 0
+            self.animation.save(f'output{i}.{extension}', writer=writer, dpi=100)
+        else:
+            if useBackgroundPhysics:
+                # Closing the window stops the thread, so it does not keep changing the objects after `run` returns
+                stopPhysics: threading.Event = threading.Event()
+                fig.canvas.mpl_connect('close_event', lambda event: stopPhysics.set())
+                physicsThread = threading.Thread(target=self.__executeNumbericalSimulation, args=(recordSnapshot, stopPhysics), daemon=True)
+                physicsThread.start()
+            plt.show()
+            # `show` only blocks until the window is closed on non-interactive backends, otherwise the thread keeps running
+            if physicsThread is not None and not plt.fignum_exists(fig.number):
+                stopPhysics.set() # In case the window was not closed through the canvas
+                physicsThread.join()
+
+    def __animationWriter(self) -> tuple[Animation.AbstractMovieWriter, str]:
+        """
+        Returns the writer used to save the animation, and the file extension it writes.
+        """
+        if FFMPEG_AVAILABLE:
+            writer = Animation.FFMpegWriter(fps=15, bitrate=1800, codec='h264', extra_args=['-preset', self.encodingSpeed, '-pix_fmt', 'yuv420p'])
+            return writer, 'mp4'
+        # GIFs are far slower to encode, only used as a fallback
+        return Animation.PillowWriter(fps=15, metadata=dict(artist='Me'), bitrate=1800), 'gif'
+
+    def __startDeadline(self) -> None:
+        # Starts the `maxRealTime` budget when the first frame is animated or the first iteration is simulated, whichever
+        # comes first, so setting up the figure does not count towards it
+        if self.__deadline is None and self.maxRealTime is not None:
+            self.__deadline = time.perf_counter_ns() + int(self.maxRealTime * 1e9)
+
+    def __executeNumbericalSimulation(self, afterIteration = None, stopEvent: threading.Event = None):
+        # Runs every iteration without drawing anything, the results are available from the history of `simObjectList`.
+        # `afterIteration` is called with the number of every completed iteration, if given.
+        # Stops early once `stopEvent` is set, if given.
+        simObjectList: SimObjectList = self.simObjectList
+        self.__startDeadline()
+        deadline: int = self.__deadline
+        if afterIteration is None and stopEvent is None and NUMBA_AVAILABLE and not any(self.__selectForceMethods(len(simObjectList))):
+            self.__executeCompiledSimulation(simObjectList, deadline)
+            return
+
+        for k in range(1, self.maxIterations + 1):
+            if deadline is not None and time.perf_counter_ns() >= deadline:
+                break
+            if stopEvent is not None and stopEvent.is_set():
+                break
+            self.__updateSimObjectKinematics(simObjectList)
+            if afterIteration is not None:
+                afterIteration(k)
+
+    def __executeCompiledSimulation(self, simObjectList: SimObjectList, deadline: int) -> None:
+        # Same as `__executeNumbericalSimulation` with the Numba direct kernel, but the iterations run in chunks inside
+        # `_runNumba`, so Python only runs between chunks instead of after every iteration.
+        # The chunks double in length while they take under 10 ms, so `maxRealTime` is still checked often enough.
+        pos: np.ndarray     = simObjectList.positions
+        vel: np.ndarray     = simObjectList.velocities
+        acc: np.ndarray     = simObjectList.accelerations
+        mass: np.ndarray    = simObjectList.masses
+        static: np.ndarray  = simObjectList.staticMask
+        eps2: float = self.softening ** 2
+
+        parallel: bool = len(simObjectList) >= NUMBA_PARALLEL_THRESHOLD
+        threadAcc: np.ndarray = simObjectList.accelerationScratch(get_num_threads() if parallel else 1)
+        if not simObjectList.accelerationsValid: # A step of length 0 only calculates the accelerations
+            (_stepNumba if parallel else _stepNumbaSerial)(pos, vel, acc, mass, static, 0.0, G, eps2, threadAcc)
+            simObjectList.accelerationsValid = True
+
+        # Without a history, buffers with no steps are passed, so nothing is ever recorded
+        noHistory: np.ndarray = np.empty((0, len(simObjectList), 2), dtype=self.historyPrecision)
+        posHistory: np.ndarray = noHistory if simObjectList._posHistory is None else simObjectList._posHistory
+        velHistory: np.ndarray = noHistory if simObjectList._velHistory is None else simObjectList._velHistory
 
+        completed: int = 0
+        chunk: int = 1 if deadline is not None else self.maxIterations
+        while completed < self.maxIterations:
+            if deadline is not None and time.perf_counter_ns() >= deadline:
+                break
+            steps: int = min(chunk, self.maxIterations - completed)
+            chunkStart: int = time.perf_counter_ns()
+            simObjectList._historyLength, simObjectList._stepsUntilRecord = _runNumba(
+                pos, vel, acc, mass, static, self.dt, G, eps2, threadAcc, parallel, steps,
+                posHistory, velHistory, simObjectList._historyLength, max(simObjectList._historyStride, 1), simObjectList._stepsUntilRecord)
+            completed += steps
+            if time.perf_counter_ns() - chunkStart < 10_000_000:
+                chunk *= 2
 
-    def __executeNumbericalSimulation(self):
-        pass
+    def __selectForceMethods(self, n: int) -> tuple[bool, bool]:
+        """
+        Returns whether the forces on `n` objects are calculated with Barnes-Hut, and whether they are calculated on the
+        device of the backend (see `setBackend`). If neither, they are summed directly on the CPU.
+        """
+        useBarnesHut: bool = self.forceMethod == 'barnesHut' or (self.forceMethod == 'auto' and NUMBA_AVAILABLE and n >= BARNES_HUT_THRESHOLD)
+        useGpu: bool = _xp is not np and n >= GPU_THRESHOLD
+        return useBarnesHut, useGpu
 
-    def __updateSimObjectKinematics(self, record: list[SimObject]) -> list[SimObject]:
+    def __updateSimObjectKinematics(self, simObjectList: SimObjectList) -> SimObjectList:
         """
-        Takes a list of `(class) SimObjects` and returns a list of `(class) SimObjects` with updated positions and velocities.
+        Takes a `(class) SimObjectList` and updates the positions and velocities stored in its arrays by one time step.
 
-        This function can be improved, as there's redundencies in this calculation method. 
+        The objects are moved with velocity Verlet (kick, drift, kick), which conserves the energy of orbits over long runs.
+        The accelerations at the end of a step are kept in `simObjectList.accelerations` for the start of the next one,
+        so the forces are still only calculated once per step.
+
+        All pairwise forces are calculated at once with `numpy` broadcasting, rather than looping over every pair of objects.
+        If Numba is installed, the compiled `_stepNumba` kernel is used instead.
+        For large simulations the forces are approximated with Barnes-Hut, see `forceMethod`.
         """
-        
-        mutualForceRecord: dict[str, dict[str, float]] = {}
-        # ^^^^ Stores the mutual forces for recipricol use. The dictionary requires a specific notation to be used properly.
-        # The first entery is the name of the principleObject, and the second entry is the attractorObject.
-        # So if we submit the following:
-        #    mutualForceRecord['object1']['object2']
-        # The value aquired will be the force which points from `object1` to `object2`.
-        # This means that the recipricol of the keys is the negitive of the resulting vector.
-
-
-        for (principleObj, i) in zip(record, range(len(record))):
-            # Loops through each `simObject` in `record` to calculate the force of each `simObject` with the other `simObject`s.
-            # The `principleObj` is the current `simObject` whose force is being determined. Think of the principle as the "Center of the Universe" so to speak
-
-            mutualForceRecord: dict[str, dict[str, Vector]] = {} # Dictionary containing all previously calulcated, mutual forces
-            # Number of calculations as a function of n where `n = len(record)` (the number of force causing objects)
-            # Without Record Keeping: n^n
-            # With Record Keeping: n!
-            # Big improvement (I don't know how to use big O notation but this does the job)
-
-            sumOfForces: Vector = Vector([0.0,0.0]) # Sum of all forces acting on `principleObj`
-
-            for attractingObj in (record[:i] + record[i + 1:]): # Removes current `simObject` from the record to avoid calculating force it has with itself
-                # Loops through to build the `sumOfForces` by adding all mutual forces the `principleObj` feels from all the other `attractingObj`s
-                
-                force_vec: Vector = Vector([0.0,0.0])
-                # Checks to see if the mutual force has already been calculated
-                if (attractingObj.name in mutualForceRecord) and (principleObj.name in mutualForceRecord[principleObj.name]):
-                    # If so, flip it around (since we're transforming the orientation of the mutual force vector)
-                    force_vec: Vector = -1 * mutualForceRecord[attractingObj.name][principleObj.name]
-                else:
-                    # If not, do the calculation and record the calculation for later
-                    force_vec: Vector = self.__mutualForce(principleObj, attractingObj)
-                    mutualForceRecord[principleObj.name] = {f'{[attractingObj.name]}' : force_vec}
-                    
-
-                sumOfForces = np.add(sumOfForces, force_vec)
-            
-
-            
-            # If the `simObject` is static, then it's position and velocity are not updated.
-            # This is done after doing the calculations so that mutual forces can be calculated for other objects.
-            if principleObj.isStatic:
-                continue
-            
+        pos: np.ndarray     = simObjectList.positions
+        vel: np.ndarray     = simObjectList.velocities
+        acc: np.ndarray     = simObjectList.accelerations
+        static: np.ndarray  = simObjectList.staticMask
+
+        eps2: float = self.softening ** 2
+        useBarnesHut, useGpu = self.__selectForceMethods(len(simObjectList))
 
-            # updates the position and velocity of the two objects
-            principleObj.position += (principleObj.velocity * self.dt) + (sumOfForces * (self.dt ** 2) / 2)
-            principleObj.velocity += (sumOfForces * self.dt) / principleObj.mass
-                
-        return record
+        if NUMBA_AVAILABLE and not useBarnesHut and not useGpu:
+            if len(simObjectList) >= NUMBA_PARALLEL_THRESHOLD:
+                stepNumba, threadAcc = _stepNumba, simObjectList.accelerationScratch(get_num_threads())
+            else:
+                stepNumba, threadAcc = _stepNumbaSerial, simObjectList.accelerationScratch()
+            if not simObjectList.accelerationsValid: # A step of length 0 only calculates the accelerations
+                stepNumba(pos, vel, acc, simObjectList.masses, static, 0.0, G, eps2, threadAcc)
+            stepNumba(pos, vel, acc, simObjectList.masses, static, self.dt, G, eps2, threadAcc)
+        else:
+            if not simObjectList.accelerationsValid:
+                self.__calculateAccelerations(simObjectList, eps2, useBarnesHut, useGpu)
+
+            # Static objects still attract the others, but are not moved themselves.
+            # As they have no velocity (enforced by `SimObject.velocity` and `run`), and `__calculateAccelerations` leaves
+            # their acceleration at 0, no mask is needed here.
+            halfDt: float = 0.5 * self.dt
+            halfDv: np.ndarray = simObjectList.accelerationScratch()[0]
+
+            # Kick and drift with the accelerations at the current positions, updated in place without temporaries
+            vel += np.multiply(acc, halfDt, out=halfDv)
+            pos += np.multiply(vel, self.dt, out=halfDv)
+
+            # Kick with the accelerations at the new positions, which are kept for the next step
+            self.__calculateAccelerations(simObjectList, eps2, useBarnesHut, useGpu)
+            vel += np.multiply(acc, halfDt, out=halfDv)
+
+        simObjectList.accelerationsValid = True
+        simObjectList.recordHistory()
+        return simObjectList
+
+    def __calculateAccelerations(self, simObjectList: SimObjectList, eps2: float, useBarnesHut: bool, useGpu: bool) -> None:
+        """
+        Writes the accelerations at the current positions into `simObjectList.accelerations`, with the method selected
+        by `__updateSimObjectKinematics`.
+        Static objects are never moved, so only the accelerations of the other objects are calculated.
+        """
+        pos: np.ndarray = simObjectList.positions
+        acc: np.ndarray = simObjectList.accelerations
+        static: np.ndarray = simObjectList.staticMask
+        if useBarnesHut:
+            _barnesHutAccelerations(pos, simObjectList.masses, static, G, eps2, self.theta, acc)
+            return
+
+        rows: np.ndarray = np.flatnonzero(~static) if static.any() else None
+        if not useGpu:
+            self.__gravitationalAccelerations(pos, simObjectList.masses, eps2, out=acc, dtype=self.precision, rows=rows)
+        else: # Calculated on the device of the backend, only the (N,2) result is copied back
+            acc[:] = _xp.asnumpy(self.__gravitationalAccelerations(_xp.asarray(pos), simObjectList.deviceMasses(_xp), eps2, xp=_xp, dtype=self.precision,
+                                                                   rows=None if rows is None else _xp.asarray(rows)))
 
     @staticmethod
-    def __mutualForce(principleObject: SimObject, attractorObject: SimObject) -> Vector:
+    def __gravitationalAccelerations(pos: np.ndarray, mass: np.ndarray, eps2: float = 0.0, out: np.ndarray = None, xp = np, dtype = 'float64',
+                                     rows: np.ndarray = None) -> np.ndarray:
         """
-        Calculates the mutual force between two objects.
+        Calculates the acceleration every object feels from the gravity of all the other objects.
+
+        Takes the `(N,2)` positions and `(N,)` masses of the objects, and the squared softening length `eps2`.
+        Returns an `(N,2)` array of accelerations,
+        written into `out` if it is given. `xp` is the array module the arrays belong to (see `setBackend`).
+        The pairwise arrays are calculated in `dtype`, the result is always `float64`.
+        If `rows` is given, only the accelerations of the objects at those indices are calculated (the others are set
+        to 0), so the pairwise arrays are `(len(rows),N)` instead of `(N,N)`.
+        The mutual forces are calculated for every pair, including reciprocal ones. Calculating each pair twice in
+        `numpy` is far cheaper than the Python bookkeeping needed to reuse them.
         """
-        r_vec: Vector       = principleObject.position - attractorObject.position # Radial direction pointing from source of attraction
-        r_squared: float    = np.dot(r_vec, r_vec) # Magnitude**2 of radial vector
-        force:  Vector      = - (G * principleObject.mass * attractorObject.mass / r_squared) * r_vec # Force calculation, which is opposite of radial direction
+        # The x and y components are kept in separate, contiguous (N,N) arrays rather than one interleaved (N,N,2) array
+        x: np.ndarray = pos[:, 0].astype(dtype)
+        y: np.ndarray = pos[:, 1].astype(dtype)
+        xi: np.ndarray = x if rows is None else x[rows]
+        yi: np.ndarray = y if rows is None else y[rows]
+        dx: np.ndarray = xi[:, np.newaxis] - x[np.newaxis, :] # (dx[i, j], dy[i, j]) points from object j to object i
+        dy: np.ndarray = yi[:, np.newaxis] - y[np.newaxis, :]
+
+        r_squared: np.ndarray = dx * dx # Magnitude**2 of every radial vector
+        r_squared += dy * dy
+        if eps2:
+            r_squared += eps2
+        # An object exerts no force on itself; 1/inf evaluates to 0 without branching
+        if rows is None:
+            xp.fill_diagonal(r_squared, xp.inf)
+        else:
+            r_squared[xp.arange(len(rows)), rows] = xp.inf
+
+        # Every following factor is applied in place, instead of allocating a new (N,N) array for each
+        # 1/|r_ij|^3 as 1/(r^2 * sqrt(r^2)), which is cheaper than `r^2 ** -1.5` as it avoids the general `pow` routine
+        weights: np.ndarray = xp.sqrt(r_squared)
+        weights *= r_squared
+        xp.reciprocal(weights, out=weights)
+        weights *= (-G * mass).astype(dtype)[np.newaxis, :] # -G*m_j/|r_ij|^3, the constant factor is folded into the (N,) masses
 
-        return force
+        # a_i = - G * sum_j ( m_j * r_ij / |r_ij|^3 ), the force on i divided by the mass of i
+        acc: np.ndarray = xp.empty((len(x), 2), dtype=np.float64) if out is None else out
+        if rows is None:
+            acc[:, 0] = xp.einsum('ij,ij->i', weights, dx)
+            acc[:, 1] = xp.einsum('ij,ij->i', weights, dy)
+        else:
+            acc[:] = 0
+            acc[rows, 0] = xp.einsum('ij,ij->i', weights, dx)
+            acc[rows, 1] = xp.einsum('ij,ij->i', weights, dy)
+        return acc
     
 if __name__ == "__main__":
     print("This is a file that is meant to be imported, not run directly.")
\ No newline at end of file